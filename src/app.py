@@ -1,21 +1,36 @@
 import asyncio
 import logging
+import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from models.query_request import QueryRequest
 from saifguard.agent import SAIFGuardAgent
+from saifguard.config import INVOKE_TIMEOUT_SECONDS
+from saifguard.streaming import batched
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+LOGGER = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Builds the agent once per worker process, after uvicorn has started it."""
+    agent = SAIFGuardAgent()
+    agent.setup()
+    app.state.agent = agent
+    yield
 
-logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(
     title="SAIFGuard Agent API",
     description="An API to interact with the SAIFGuard ADK Agent.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
-agent = SAIFGuardAgent()
-
 
 @app.get("/healthcheck")
 def healthcheck():
@@ -24,17 +39,43 @@ def healthcheck():
 
 
 @app.post("/invoke")
-async def invoke_agent(request: QueryRequest):
+async def invoke_agent(request: Request, query: QueryRequest):
     """
     Receives a user message and streams the agent's response back.
     """
+    agent = getattr(request.app.state, "agent", None)
     if not agent:
         raise HTTPException(status_code=500, detail="Agent not initialized.")
 
     try:
-        response = agent.invoke(user_id=request.user_id, message=request.message)
-        return StreamingResponse(response, media_type="text/plain")
+        response = agent.invoke(user_id=query.user_id, message=query.message)
+        response = _guard_stream(request, response)
+        return StreamingResponse(batched(response), media_type="text/plain; charset=utf-8")
 
     except Exception as e:
-        print(f"Error during agent invocation: {e}")
+        LOGGER.exception(f"Error during agent invocation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _guard_stream(request: Request, stream):
+    """
+    Stops the agent stream when the client disconnects or the deadline passes.
+    """
+    deadline = asyncio.get_running_loop().time() + INVOKE_TIMEOUT_SECONDS
+    try:
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    chunk = await anext(stream)
+            except StopAsyncIteration:
+                break
+            if await request.is_disconnected():
+                LOGGER.info("Client disconnected, stopping the agent stream.")
+                break
+            yield chunk
+    except TimeoutError:
+        LOGGER.warning(f"Agent stream exceeded {INVOKE_TIMEOUT_SECONDS} seconds, stopping it.")
+        # Tells the client the answer was cut off rather than complete
+        yield f"\n\n*Response stopped after {INVOKE_TIMEOUT_SECONDS} seconds.*"
+    finally:
+        await stream.aclose()
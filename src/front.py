@@ -1,4 +1,3 @@
-import random
 import time
 from dataclasses import asdict, dataclass
 from typing import Callable, Literal
@@ -23,6 +22,7 @@ _CHAT_MAX_WIDTH = "800px"
 _MOBILE_BREAKPOINT = 640
 
 agent = SAIFGuardAgent()
+agent.setup()
 
 @dataclass(kw_only=True)
 class ChatMessage:
@@ -59,7 +59,7 @@ def respond_to_chat(input: str, history: list[ChatMessage]):
 *{message.role}*: {message.content}
 """
 
-  response = agent.invoke(user_id="test", message=agent_input)
+  response = agent.invoke_sync(user_id="test", message=agent_input)
   for line in response:
     time.sleep(0.3)
     yield line + " "
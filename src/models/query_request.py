@@ -1,7 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
 class QueryRequest(BaseModel):
     """Defines the structure of the incoming request body."""
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     user_id: str
     message: str
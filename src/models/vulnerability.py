@@ -13,3 +13,7 @@ class Vulnerability(BaseModel):
 
 class VulnerabilityList(BaseModel):
     vulnerabilities: List[Vulnerability]
+
+class SecurityReport(BaseModel):
+    markdown_report: str
+    vulnerabilities: List[Vulnerability]
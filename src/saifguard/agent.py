@@ -1,16 +1,22 @@
+import asyncio
 import logging
+import queue
+import threading
 
+import orjson
 from google.adk.agents import Agent
-from google.cloud import aiplatform
 from google.genai import types
 from saifguard.analysis_tool import analysis_tool
+from saifguard.clients import init_aiplatform
 from saifguard.gcp_project_tool import gcp_project_tool
 from saifguard.google_search_tool import google_search_tool
-from saifguard.config import MODEL, PROJECT_ID, REGION
+from saifguard.config import MODEL
 from vertexai.preview.reasoning_engines import AdkApp
 
 LOGGER = logging.getLogger(__name__)
 
+_DONE = object()
+
 AGENT_INSTRUCTION_PROMPT = """
 <OBJECTIVE_AND_PERSONA>
 You are an AI assistant tasked with helping developpers make sure their applications on GCP follow the SAIF Security framework.
@@ -37,7 +43,17 @@ class SAIFGuardAgent:
     """Main class for SAIFGuard Agent definition"""
 
     def __init__(self):
-        aiplatform.init(project=PROJECT_ID, location=REGION)
+        self.app = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def setup(self):
+        """Initializes Vertex AI and builds the ADK agent.
+
+        Kept out of __init__ so servers can run it per worker at startup rather
+        than at import time.
+        """
+        init_aiplatform()
 
         safety_settings = [
             types.SafetySetting(
@@ -60,26 +76,78 @@ class SAIFGuardAgent:
         )
         self.app = AdkApp(agent=agent)
 
-    def invoke(self, user_id: str, message: str):
-        LOGGER.info(f"Invoking the agent for user {user_id}, with message: {message}")
-        for event in self.app.stream_query(
+    async def invoke(self, user_id: str, message: str):
+        LOGGER.info("Invoking the agent for user %s", user_id)
+        LOGGER.debug("Agent message: %s", message)
+        async for event in self.app.async_stream_query(
             user_id=user_id,
             message=message,
         ):
-            LOGGER.info("**** START EVENT *****")
-            LOGGER.info(event)
-            LOGGER.info("**** END EVENT *****")
-            if (
-                "content" in event
-                and "parts" in event["content"]
-                and "text" in event["content"]["parts"][0]
-            ):
-                yield "\n".join([part["text"] for part in event["content"]["parts"]])
-            
-            if (
-                "content" in event
-                and "parts" in event["content"]
-                and "function_response" in event["content"]["parts"][0]
-            ):
-                # Yield tool message to pass in conversation history
-                yield f'*tool*: {"\n".join([part["function_response"]["response"]["result"] for part in event["content"]["parts"]])}'
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug("Agent event: %s", orjson.dumps(event, default=str).decode())
+            parts = (event.get("content") or {}).get("parts")
+            if not parts:
+                continue
+            first_part = parts[0]
+            for part_type, render in _PART_RENDERERS:
+                if part_type in first_part:
+                    yield render(parts)
+                    break
+
+    def invoke_sync(self, user_id: str, message: str):
+        """Streams invoke() to synchronous callers such as the Mesop UI.
+
+        The whole invoke() iteration runs as one coroutine on a background event
+        loop, created once per agent, and hands chunks back through a thread-safe
+        queue so the stream keeps a single task and context.
+        """
+        loop = self._background_loop()
+        chunks = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._pump(user_id, message, chunks), loop
+        )
+        try:
+            while (chunk := chunks.get()) is not _DONE:
+                yield chunk
+            future.result()
+        finally:
+            future.cancel()
+
+    async def _pump(self, user_id: str, message: str, chunks: queue.Queue):
+        stream = self.invoke(user_id=user_id, message=message)
+        try:
+            async for chunk in stream:
+                chunks.put_nowait(chunk)
+        finally:
+            await stream.aclose()
+            chunks.put_nowait(_DONE)
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="saifguard-agent-loop",
+                    daemon=True,
+                ).start()
+            return self._loop
+
+
+def _render_text(parts) -> str:
+    return "\n".join(part["text"] for part in parts)
+
+
+def _render_tool_response(parts) -> str:
+    # Tool messages are yielded to pass them in the conversation history
+    return "*tool*: " + "\n".join(
+        part["function_response"]["response"]["result"] for part in parts
+    )
+
+
+# Checked in order against the first part of each streamed event
+_PART_RENDERERS = (
+    ("text", _render_text),
+    ("function_response", _render_tool_response),
+)
+
@@ -1,14 +1,27 @@
+import asyncio
 import logging
-import traceback
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 
 from google.cloud import storage
-from google import genai
 from google.genai import types
-from saifguard.config import MODEL, PROJECT_ID, REGION, GOOGLE_SEARCH_SAIF_PROMPT
-from saifguard.google_search_tool import google_search_tool
+from saifguard.cache import SingleFlight, TTLCache, cache_key
+from saifguard.clients import get_genai_client, get_storage_client
+from saifguard.config import ANALYSIS_CACHE_TTL_SECONDS, HTTP_POOL_SIZE, MODEL
+from saifguard.google_search_tool import (
+    SAIF_UNAVAILABLE_NOTE,
+    get_saif_recommendations,
+    saif_recommendations_part,
+)
 
 LOGGER = logging.getLogger(__name__)
 
+_ANALYSIS_CACHE = TTLCache(ttl=ANALYSIS_CACHE_TTL_SECONDS)
+_IN_FLIGHT = SingleFlight()
+# google-cloud-storage is blocking, its calls share this pool across requests
+_IO_POOL = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="analysis-io")
+
 
 DISCOVERY_TOOL_SYSTEM_PROMPT = """
 <OBJECTIVE_AND_PERSONA>
@@ -59,60 +72,97 @@ Use the provided Google Search results for the latest SAIF compliance recommenda
 Make sure you show both recommendations related to SAIF compliance recommendations and security requirements. 
 """
 
+# The prompts are static, build their request objects once and share them
+_QUERY_PART = types.Part.from_text(text=DISCOVERY_TOOL_QUERY_PROMPT)
+_GENERATE_CONTENT_CONFIG = types.GenerateContentConfig(
+    system_instruction=DISCOVERY_TOOL_SYSTEM_PROMPT,
+    temperature=0.1,
+)
+
 
-def analysis_tool(gcs_uri: str):
+async def analysis_tool(gcs_uri: str):
     """Analyze the documents within a GCS bucket.
 
     Args:
         gcs_uri (str): GCS bucket URI (e.g., gs://my-bucket/folder/).
     """
+    key = cache_key(gcs_uri, DISCOVERY_TOOL_QUERY_PROMPT)
+    cached_report = _ANALYSIS_CACHE.get(key)
+    if cached_report is not None:
+        LOGGER.info(f"Returning cached analysis for {gcs_uri}")
+        return cached_report
+
     try:
-        LOGGER.info(f"Calling analysis_tool with {gcs_uri}")
-
-        # Get latest SAIF recommendations from Google Search
-        LOGGER.info("Fetching latest SAIF recommendations using Google Search.")
-        saif_recommendations = google_search_tool(GOOGLE_SEARCH_SAIF_PROMPT)
-
-        contents = []
-
-        # List files in the GCS bucket and add them to the contents
-        storage_client = storage.Client()
-        bucket_name = gcs_uri.replace("gs://", "").strip("/")
-        bucket = storage_client.bucket(bucket_name)        
-        LOGGER.info(f"Listing files in bucket '{bucket_name}'.")
-        blobs = bucket.list_blobs()
-
-        # Construct the prompt with documents and their names
-        contents.append(types.Part.from_text(text=DISCOVERY_TOOL_QUERY_PROMPT))
-
-        for blob in blobs:
-            file_uri = f"gs://{bucket_name}/{blob.name}"
-            file_name = blob.name
-            LOGGER.info(f"Adding file '{file_name}' from {file_uri} to analysis contents.")
-            
-            # Provide the file name as context for the LLM
-            contents.append(types.Part.from_text(text=f"\nDocument name: {file_name}"))
-            contents.append(types.Part.from_uri(file_uri=file_uri, mime_type=None))
-
-        contents.append(types.Part.from_text(text=f"LATEST SAIF RECOMMENDATIONS:\n{saif_recommendations}"))
-
-        client = genai.Client(
-            vertexai=True,
-            project=PROJECT_ID,
-            location=REGION,
-        )
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=DISCOVERY_TOOL_SYSTEM_PROMPT,
-                temperature=0.1,
-            ),
-        )
-        LOGGER.info(response)
-        return response.text
+        # Concurrent calls for the same documents share a single analysis
+        report, complete = await _IN_FLIGHT.do(key, _analyze, gcs_uri)
     except Exception as e:
         message = f"An exception occurred while calling analysis_tool: {e}"
-        LOGGER.error(message)
-        LOGGER.error(f"Traceback: {traceback.format_exc()}")
+        LOGGER.exception(message)
         return message
+    # A report made without the SAIF recommendations is not cached, the next
+    # call retries the search
+    if complete:
+        _ANALYSIS_CACHE.set(key, report)
+    return report
+
+
+async def _analyze(gcs_uri: str) -> Tuple[str, bool]:
+    """
+    Generates the security report for the documents of a GCS bucket.
+
+    Returns the report and whether the SAIF recommendations were available.
+    """
+    LOGGER.info(f"Calling analysis_tool with {gcs_uri}")
+    bucket_name = gcs_uri.replace("gs://", "").strip("/")
+
+    # Get latest SAIF recommendations from Google Search and list the files in
+    # the GCS bucket concurrently, both are independent blocking calls
+    LOGGER.info("Fetching latest SAIF recommendations using Google Search.")
+    LOGGER.info(f"Listing files in bucket '{bucket_name}'.")
+    loop = asyncio.get_running_loop()
+    saif_recommendations, blobs = await asyncio.gather(
+        loop.run_in_executor(_IO_POOL, get_saif_recommendations),
+        loop.run_in_executor(_IO_POOL, _list_blobs, bucket_name),
+    )
+
+    # Construct the prompt with documents and their names
+    contents = [_QUERY_PART]
+
+    for blob in blobs:
+        file_uri = f"gs://{bucket_name}/{blob.name}"
+        file_name = blob.name
+        LOGGER.info(f"Adding file '{file_name}' from {file_uri} to analysis contents.")
+        
+        # Provide the file name as context for the LLM
+        contents.append(types.Part.from_text(text=f"\nDocument name: {file_name}"))
+        contents.append(types.Part.from_uri(file_uri=file_uri, mime_type=None))
+
+    contents.append(saif_recommendations_part(saif_recommendations))
+
+    start_time = time.time()
+    client = get_genai_client()
+    stream = await client.aio.models.generate_content_stream(
+        model=MODEL,
+        contents=contents,
+        config=_GENERATE_CONTENT_CONFIG,
+    )
+    # ADK function tools return a single result, so the streamed chunks are
+    # accumulated here rather than forwarded through the tool boundary
+    chunks = []
+    async for chunk in stream:
+        if chunk.text:
+            if not chunks:
+                LOGGER.info(f"First report chunk received after {time.time() - start_time:.2f} seconds.")
+            chunks.append(chunk.text)
+    LOGGER.info(f"Generating analysis report took {time.time() - start_time:.2f} seconds.")
+    if saif_recommendations is None:
+        return SAIF_UNAVAILABLE_NOTE + "".join(chunks), False
+    return "".join(chunks), True
+
+
+def _list_blobs(bucket_name: str) -> List[storage.Blob]:
+    """
+    Lists all the blobs of a GCS bucket, fetching every page.
+    """
+    bucket = get_storage_client().bucket(bucket_name)
+    return list(bucket.list_blobs())
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+import orjson
+from saifguard.config import CACHE_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+
+def cache_key(*parts: str) -> str:
+    """Build a stable digest from the given strings."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded in-memory cache with per-entry expiry."""
+
+    def __init__(self, ttl: float, maxsize: int = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class DiskCache:
+    """JSON file cache under CACHE_DIR, entries expire with their file's age.
+
+    Entries survive process restarts and are shared between workers. Expired
+    entries are deleted when read and when the namespace is written to, and files
+    are only readable by their owner since entries may hold project configuration.
+    Read and write errors are logged and treated as cache misses.
+    """
+
+    def __init__(self, namespace: str, ttl: float):
+        self.directory = Path(CACHE_DIR) / namespace
+        self.ttl = ttl
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return orjson.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            LOGGER.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+    def set(self, key: str, value: Any):
+        path = self._path(key)
+        # Written to a temporary file first so readers never see a partial entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            Path(CACHE_DIR).mkdir(mode=0o700, parents=True, exist_ok=True)
+            self.directory.mkdir(mode=0o700, exist_ok=True)
+            self.directory.chmod(0o700)
+            self._prune()
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(orjson.dumps(value))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            LOGGER.warning(f"Could not write cache entry {path}: {e}")
+
+    def _prune(self):
+        """Deletes the namespace's expired entries and leftover temporary files."""
+        expiry = time.time() - self.ttl
+        for path in self.directory.iterdir():
+            try:
+                if path.stat().st_mtime < expiry:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+
+class SingleFlight:
+    """Coalesce concurrent coroutine calls that share a key.
+
+    While a call is in flight, later callers with the same key await its result
+    instead of starting their own. Entries are scoped to the running event loop.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Task] = {}
+
+    async def do(self, key: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        flight_key = (asyncio.get_running_loop(), key)
+        task = self._in_flight.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._in_flight[flight_key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(flight_key, None))
+        else:
+            LOGGER.info("Joining in-flight call instead of starting a new one.")
+        # Shielded so a cancelled caller does not cancel the shared call
+        return await asyncio.shield(task)
+
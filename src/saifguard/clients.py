@@ -0,0 +1,111 @@
+import functools
+import threading
+
+import google.auth
+import httpx
+from google import genai
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import asset_v1, bigquery, storage
+from google.genai import types
+from requests.adapters import HTTPAdapter
+from saifguard.config import DASHBOARD_BQ_PROJECT, HTTP_POOL_SIZE, PROJECT_ID, REGION
+
+# Keep-alive HTTP/2 connections let back-to-back and concurrent Gemini calls
+# share connections instead of paying a TCP and TLS handshake each
+_GENAI_HTTP_CLIENT_ARGS = {
+    "http2": True,
+    "limits": httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE // 2,
+    ),
+}
+
+# Transient Vertex AI errors (quota, unavailable, gateway timeout) are retried with
+# exponential backoff and jitter instead of failing the whole tool call
+_GENAI_RETRY_OPTIONS = types.HttpRetryOptions(
+    attempts=5,
+    initial_delay=1.0,
+    max_delay=16.0,
+    exp_base=2,
+    jitter=1,
+    http_status_codes=[429, 503, 504],
+)
+
+
+def _shared(factory):
+    """Caches a no-argument factory's result, like functools.cache.
+
+    First calls are serialized by a lock, so concurrent threads, e.g. the asset
+    type group searches of a first scan, share one client and its connections
+    instead of each building its own.
+    """
+    lock = threading.Lock()
+    instances = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instances:
+            with lock:
+                if not instances:
+                    instances.append(factory())
+        return instances[0]
+
+    return get
+
+
+@_shared
+def get_genai_client() -> genai.Client:
+    """Return the process-wide Vertex AI Gemini client.
+
+    Reusing a single client keeps its HTTP connections, TLS sessions and
+    credentials warm instead of rebuilding them on every tool call.
+    """
+    return genai.Client(
+        vertexai=True,
+        project=PROJECT_ID,
+        location=REGION,
+        http_options=types.HttpOptions(
+            client_args=_GENAI_HTTP_CLIENT_ARGS,
+            async_client_args=_GENAI_HTTP_CLIENT_ARGS,
+            retry_options=_GENAI_RETRY_OPTIONS,
+        ),
+    )
+
+
+@_shared
+def get_asset_client() -> asset_v1.AssetServiceClient:
+    """Return the process-wide Cloud Asset Inventory client.
+
+    The generated gRPC client is thread-safe, sharing it reuses its channel and
+    credentials across calls.
+    """
+    return asset_v1.AssetServiceClient()
+
+
+@_shared
+def get_bigquery_client() -> bigquery.Client:
+    """Return the process-wide BigQuery client for the dashboard project."""
+    return bigquery.Client(project=DASHBOARD_BQ_PROJECT)
+
+
+@_shared
+def get_storage_client() -> storage.Client:
+    """Return the process-wide Cloud Storage client.
+
+    Its HTTP session keeps up to HTTP_POOL_SIZE connections per host so that
+    concurrent calls from worker threads reuse connections.
+    """
+    credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return storage.Client(project=PROJECT_ID, credentials=credentials, _http=session)
+
+
+@_shared
+def init_aiplatform():
+    """Initialize the Vertex AI SDK once per process."""
+    # Imported here, the SDK is large and only needed when the agent is built
+    from google.cloud import aiplatform
+
+    aiplatform.init(project=PROJECT_ID, location=REGION)
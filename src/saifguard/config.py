@@ -1,9 +1,34 @@
-PROJECT_ID = "saifguard-gf-rrag-0"
-REGION = "europe-west4"
-MODEL = "gemini-2.5-flash"
-GENERATE_DASHBOARD = True
-DASHBOARD_BQ_PROJECT = "saifguard"
-DASHBOARD_BQ_LOCATION = "dashboard.vulnerabilities"
+import os
+
+# Deployment settings can be overridden with environment variables of the same name
+PROJECT_ID = os.environ.get("PROJECT_ID", "saifguard-gf-rrag-0")
+REGION = os.environ.get("REGION", "europe-west4")
+MODEL = os.environ.get("MODEL", "gemini-2.5-flash")
+GENERATE_DASHBOARD = os.environ.get("GENERATE_DASHBOARD", "True").lower() == "true"
+DASHBOARD_BQ_PROJECT = os.environ.get("DASHBOARD_BQ_PROJECT", "saifguard")
+DASHBOARD_BQ_LOCATION = os.environ.get("DASHBOARD_BQ_LOCATION", "dashboard.vulnerabilities")
+HTTP_POOL_SIZE = 32
+# Upper bound for one /invoke stream, project scans chain several model calls
+INVOKE_TIMEOUT_SECONDS = 300
+CACHE_DIR = os.path.expanduser("~/.cache/saifguard")
+SAIF_CACHE_TTL_SECONDS = 6 * 60 * 60
+ASSET_CACHE_TTL_SECONDS = 5 * 60
+# Distinct resources of one asset type sent to the model, the rest are only named;
+# oversized dumps are split across calls, so this only bounds pathological projects
+MAX_RESOURCES_PER_ASSET_TYPE = 200
+# Request and send every Asset Inventory field instead of the audited subset,
+# for debugging; makes the asset dump and the prompt much larger
+FULL_ASSET_SCAN = False
+# Asset dumps longer than this are split and audited by concurrent model calls
+ASSET_DUMP_CHUNK_CHARS = 400_000
+# Bucket the asset dumps are uploaded to and passed to the model by URI, instead
+# of inline in the request; None sends them inline
+ASSET_DUMP_BUCKET = os.environ.get("ASSET_DUMP_BUCKET")
+ANALYSIS_CACHE_TTL_SECONDS = 60 * 60
+# Lifetime of the Gemini cached content holding the project scan system prompt
+PROMPT_CACHE_TTL_SECONDS = 60 * 60
+# Write the prompt inputs to the working directory for troubleshooting
+DEBUG_DUMP = os.environ.get("SAIFGUARD_DEBUG_DUMP") == "1"
 GOOGLE_SEARCH_SAIF_PROMPT = """
 <Task>
 Retrieve the latest, comprehensive documentation for Google's Secure AI Framework (SAIF).
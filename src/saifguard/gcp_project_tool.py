@@ -1,33 +1,217 @@
-import json
+import asyncio
+import hashlib
+import io
 import logging
-import traceback
 import time
-from textwrap import dedent
-from typing import List
-
-import pandas as pd
-from opentelemetry import trace
-from google import genai
-from google.cloud import asset_v1
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from google.api_core import exceptions as core_exceptions
+from google.api_core import retry as retries
+from google.cloud import asset_v1, bigquery
 from google.genai import types
 from google.protobuf import field_mask_pb2
-from google.protobuf.json_format import MessageToJson
-from models.vulnerability import VulnerabilityList
-
-# Assuming saifguard.config exists and contains these variables
+from google.protobuf.internal import api_implementation
+from google.protobuf.json_format import MessageToDict
+from models.vulnerability import SecurityReport, Vulnerability
+from pydantic import ValidationError
+from saifguard.cache import DiskCache, SingleFlight, TTLCache, cache_key
+from saifguard.clients import (
+    get_asset_client,
+    get_bigquery_client,
+    get_genai_client,
+    get_storage_client,
+)
 from saifguard.config import (
+    ASSET_CACHE_TTL_SECONDS,
+    ASSET_DUMP_BUCKET,
+    ASSET_DUMP_CHUNK_CHARS,
     DASHBOARD_BQ_LOCATION,
     DASHBOARD_BQ_PROJECT,
+    DEBUG_DUMP,
+    FULL_ASSET_SCAN,
     GENERATE_DASHBOARD,
-    GOOGLE_SEARCH_SAIF_PROMPT,
+    HTTP_POOL_SIZE,
+    MAX_RESOURCES_PER_ASSET_TYPE,
     MODEL,
     PROJECT_ID,
-    REGION,
+    PROMPT_CACHE_TTL_SECONDS,
+)
+from saifguard.google_search_tool import (
+    SAIF_UNAVAILABLE_NOTE,
+    get_saif_recommendations,
+    saif_recommendations_part,
 )
-from saifguard.google_search_tool import google_search_tool
 
 LOGGER = logging.getLogger(__name__)
 
+# Asset conversion walks protobuf messages, which is several times slower on the
+# pure Python backend than on the default upb C extension
+if api_implementation.Type() == "python":
+    LOGGER.warning(
+        "The pure Python protobuf implementation is active, Asset Inventory "
+        "exports will be slow. Unset PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION."
+    )
+
+_ASSET_CACHE = DiskCache("assets", ttl=ASSET_CACHE_TTL_SECONDS)
+# Cached content name for the discovery system prompt and SAIF recommendations,
+# renewed a minute before the server-side cache expires. An empty name records a
+# failed creation.
+_PROMPT_CACHE = TTLCache(ttl=PROMPT_CACHE_TTL_SECONDS - 60, maxsize=1)
+_IN_FLIGHT = SingleFlight()
+# The Google Search, Asset Inventory, Cloud Storage and BigQuery clients are
+# blocking, their calls share this pool across requests
+_IO_POOL = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="gcp-project-io")
+# Asset type group searches, kept apart from _IO_POOL which waits on them
+_ASSET_SEARCH_POOL = ThreadPoolExecutor(
+    max_workers=HTTP_POOL_SIZE, thread_name_prefix="asset-search"
+)
+# Replaces the dashboard table, one STRING column per Vulnerability field
+_DASHBOARD_LOAD_JOB_CONFIG = bigquery.LoadJobConfig(
+    schema=[
+        bigquery.SchemaField(field, "STRING")
+        for field in (*Vulnerability.model_fields, "project_id")
+    ],
+    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+)
+# Debug dumps are written off the request path, in submission order
+_DEBUG_DUMP_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="debug-dump")
+
+# ResourceSearchResult fields requested from Asset Inventory unless
+# FULL_ASSET_SCAN is set, everything else is left out of the response and prompt
+_ASSET_READ_MASK_PATHS = [
+    "name",
+    "assetType",
+    "location",
+    "labels",
+    "networkTags",
+    "kmsKeys",
+    "additionalAttributes",
+    "state",
+    "parentFullResourceName",
+]
+# Resource configuration fields the audit checks, kept from versionedResources
+# per asset type, e.g. the security policy of a backend service. versionedResources
+# is only requested for the groups holding one of these types.
+_VERSIONED_RESOURCE_FIELDS = {
+    "iam.googleapis.com/ServiceAccountKey": (
+        "keyType", "keyOrigin", "validAfterTime", "validBeforeTime", "disabled",
+    ),
+    "iam.googleapis.com/ServiceAccount": ("disabled",),
+    "compute.googleapis.com/ForwardingRule": (
+        "IPAddress", "IPProtocol", "portRange", "loadBalancingScheme", "target", "networkTier",
+    ),
+    "compute.googleapis.com/TargetHttpsProxy": ("sslCertificates", "sslPolicy", "quicOverride"),
+    "compute.googleapis.com/TargetHttpProxy": ("urlMap",),
+    "compute.googleapis.com/SslCertificate": ("type", "expireTime", "subjectAlternativeNames"),
+    "compute.googleapis.com/SecurityPolicy": (
+        "type", "rules", "adaptiveProtectionConfig", "ddosProtectionConfig",
+    ),
+    "compute.googleapis.com/BackendService": (
+        "securityPolicy", "edgeSecurityPolicy", "loadBalancingScheme", "protocol", "iap",
+        "logConfig", "enableCDN",
+    ),
+    "compute.googleapis.com/Subnetwork": ("privateIpGoogleAccess", "logConfig", "purpose"),
+    "compute.googleapis.com/Network": ("autoCreateSubnetworks",),
+    "dns.googleapis.com/ManagedZone": ("visibility", "dnssecConfig", "privateVisibilityConfig"),
+    "storage.googleapis.com/Bucket": (
+        "iamConfiguration", "encryption", "cors", "versioning", "logging", "retentionPolicy",
+    ),
+    "sqladmin.googleapis.com/Instance": ("databaseVersion", "settings"),
+    "bigquery.googleapis.com/Dataset": ("access", "defaultEncryptionConfiguration"),
+    "bigquery.googleapis.com/Table": ("encryptionConfiguration",),
+    "run.googleapis.com/Service": ("metadata", "spec"),
+    "run.googleapis.com/Revision": ("spec",),
+    "run.googleapis.com/Job": ("spec",),
+    "logging.googleapis.com/LogSink": ("destination", "filter", "disabled"),
+    "logging.googleapis.com/LogBucket": ("retentionDays", "locked", "cmekSettings"),
+}
+# Audited asset types, grouped by service so that each group is searched
+# concurrently with its own pager
+_ASSET_TYPE_GROUPS = [
+    [
+        "iam.googleapis.com/ServiceAccountKey",
+        "iam.googleapis.com/ServiceAccount",
+    ],
+    [
+        "compute.googleapis.com/ForwardingRule",
+        "compute.googleapis.com/UrlMap",
+        "compute.googleapis.com/TargetHttpsProxy",
+        "compute.googleapis.com/TargetHttpProxy",
+        "compute.googleapis.com/SslCertificate",
+        "compute.googleapis.com/SecurityPolicy",
+        "compute.googleapis.com/NetworkEndpointGroup",
+        "compute.googleapis.com/BackendService",
+    ],
+    [
+        "compute.googleapis.com/Route",
+        "compute.googleapis.com/Address",
+        "compute.googleapis.com/Subnetwork",
+        "compute.googleapis.com/Network",
+        "compute.googleapis.com/Project",
+    ],
+    [
+        "dns.googleapis.com/ResourceRecordSet",
+        "dns.googleapis.com/ResponsePolicy",
+        "dns.googleapis.com/ManagedZone",
+        "servicedirectory.googleapis.com/Service",
+        "servicedirectory.googleapis.com/Namespace",
+        "servicedirectory.googleapis.com/Endpoint",
+    ],
+    [
+        "storage.googleapis.com/Bucket",
+        "sqladmin.googleapis.com/Instance",
+        "bigquery.googleapis.com/Table",
+        "bigquery.googleapis.com/Dataset",
+        "dataplex.googleapis.com/EntryGroup",
+    ],
+    [
+        "run.googleapis.com/Service",
+        "run.googleapis.com/Revision",
+        "run.googleapis.com/Job",
+    ],
+    [
+        "logging.googleapis.com/LogSink",
+        "logging.googleapis.com/LogBucket",
+        "cloudresourcemanager.googleapis.com/Project",
+        "cloudbilling.googleapis.com/ProjectBillingInfo",
+    ],
+]
+# Searches are retried on transient errors only, a failing asset type group is
+# otherwise reported as missing
+_ASSET_SEARCH_RETRY = retries.Retry(
+    predicate=retries.if_exception_type(
+        core_exceptions.ServiceUnavailable,
+        core_exceptions.DeadlineExceeded,
+        core_exceptions.ResourceExhausted,
+    ),
+    initial=1.0,
+    maximum=16.0,
+    multiplier=2.0,
+    timeout=120.0,
+)
+# Fields ignored when looking for duplicate resources
+_RESOURCE_IDENTITY_FIELDS = frozenset(
+    ("name", "display_name", "create_time", "update_time", "etag")
+)
+# Asset types where each resource matters on its own, never deduplicated
+_NO_DEDUP_ASSET_TYPES = frozenset(("iam.googleapis.com/ServiceAccountKey",))
+# ResourceSearchResult fields copied as is when set
+_RESOURCE_SCALAR_FIELDS = (
+    "name",
+    "asset_type",
+    "location",
+    "state",
+    "parent_full_resource_name",
+)
+_RESOURCE_REPEATED_FIELDS = (
+    "network_tags",
+    "kms_keys",
+)
+
 
 DISCOVERY_TOOL_SYSTEM_PROMPT = """
 <OBJECTIVE_AND_PERSONA>
@@ -89,35 +273,40 @@ Generate your final report in Markdown. For each vulnerability you discover, pro
 </RECAP>
 """
 
-DISCOVERY_TOOL_QUERY_PROMPT = "Inspect the GCP project assets provided and generate detailed recommendations to improve the overall security posture. Use the provided Google Search results for the latest SAIF compliance recommendations as a reference."
+DISCOVERY_TOOL_QUERY_PROMPT = "Inspect the GCP project assets provided and generate detailed recommendations to improve the overall security posture. Use the provided Google Search results for the latest SAIF compliance recommendations as a reference. A resource with \"_duplicate_names\" stands for those resources too, they share its configuration: a finding on it also applies to them, list their names in its Location."
 
 
 DASHBOARD_SYSTEM_PROMPT = """
-<OBJECTIVE>
-A list of vulnerability descriptions from a GCP project is given to you as text. 
-You need to transform it into a dataframe to pass to BigQuery for dashboarding.
-You need to extract the google cloud console URL for each vulnerable resources to allow the user to click on it.
-</OBJECTIVE>
-
-<INSTRUCTIONS>
-Think step by step:
-1. Identify the vulnerable GCP resources.
-2. For each resource, extract the location given as a the name from asset inventory command and produce the GCP console URL. Extract the vulnerability name, description and remediation.
-</INSTRUCTIONS>
-
-<FEW_SHOT_EXAMPLES>
+<DASHBOARD_OUTPUT>
+The findings are also published to BigQuery for dashboarding. Return a JSON object with two fields:
+- "markdown_report": the complete Markdown report described in OUTPUT.
+- "vulnerabilities": one entry per vulnerability in the report.
+For each vulnerability entry, think step by step:
+1. Keep the vulnerability name, description and remediation exactly as written in the report, with its severity and the category of the resource.
+2. Convert the location, given as the resource name from the asset inventory, into the GCP console URL of the resource to allow the user to click on it.
+</DASHBOARD_OUTPUT>
+
+<DASHBOARD_EXAMPLES>
 # Example 1
-## Input
-**Vulnerabilities:** 
-\n\n### 🔴 Critical\n\n* Lack of Web Application Firewall (WAF) / DDoS Protection on External Load Balancer\n    *   **Location:** `//compute.googleapis.com/projects/[PROJECT_ID]/global/backendServices/[BACKEND SERVICE NAME]`\n    *   **Description:** The external HTTP(S) Load Balancer\'s backend service (`[BACKEND SERVICE NAME]`) does not have a Cloud Armor security policy attached    *   **Remediation:** Attach a Cloud Armor security policy
-\n\n### 🔴 Medium\n\n* Disabled Backups for Cloud SQL Instance\n    *   **Location:** `//cloudsql.googleapis.com/projects/[PROJECT_ID]/instances/[CLOUD SQL INSTANCE NAME]`\n    *   **Description:** The Cloud SQL instance `[CLOUD SQL INSTANCE NAME]` has automated backups disabled *   **Remediation:** Enable automated backups
+## Report findings
+### 🔴 Critical
+- **Vulnerability:** Lack of Web Application Firewall (WAF) / DDoS Protection on External Load Balancer
+- **Location:** `//compute.googleapis.com/projects/[PROJECT_ID]/global/backendServices/[BACKEND SERVICE NAME]`
+- **Description:** The external HTTP(S) Load Balancer's backend service (`[BACKEND SERVICE NAME]`) does not have a Cloud Armor security policy attached
+- **Remediation:** Attach a Cloud Armor security policy
 
-##Thoughts
+### 🟡 Medium
+- **Vulnerability:** Disabled Backups for Cloud SQL Instance
+- **Location:** `//cloudsql.googleapis.com/projects/[PROJECT_ID]/instances/[CLOUD SQL INSTANCE NAME]`
+- **Description:** The Cloud SQL instance `[CLOUD SQL INSTANCE NAME]` has automated backups disabled
+- **Remediation:** Enable automated backups
+
+## Thoughts
 1. There are 2 vulnerabilities listed, the first on the external load balancer backend service, the second on Cloud SQL instance
 2. //compute.googleapis.com/projects/[PROJECT_ID]/global/backendServices/[BACKEND SERVICE NAME] is mapped to the console URL https://console.cloud.google.com/net-services/loadbalancing/backends/details/backendService/[BACKEND SERVICE NAME]?project=[PROJECT_ID]
 //cloudsql.googleapis.com/projects/[PROJECT_ID]/instances/[CLOUD SQL INSTANCE NAME] is mapped to the console URL https://console.cloud.google.com/sql/instances/[CLOUD SQL INSTANCE NAME]/overview?project=[PROJECT_ID]
 
-## Output
+## vulnerabilities
 [
     {
         severity: "Critical"
@@ -136,17 +325,26 @@ Think step by step:
         url: "https://console.cloud.google.com/sql/instances/[CLOUD SQL INSTANCE NAME]/overview?project=[PROJECT_ID]"
     }
 ]
-</FEW_SHOT_EXAMPLES>
+</DASHBOARD_EXAMPLES>
+"""
 
+# With the dashboard enabled, the report and its dashboard rows come from a
+# single structured call instead of a second call re-parsing the report
+if GENERATE_DASHBOARD:
+    _SYSTEM_PROMPT = DISCOVERY_TOOL_SYSTEM_PROMPT + DASHBOARD_SYSTEM_PROMPT
+    _RESPONSE_FORMAT = {
+        "response_mime_type": "application/json",
+        "response_schema": SecurityReport,
+    }
+else:
+    _SYSTEM_PROMPT = DISCOVERY_TOOL_SYSTEM_PROMPT
+    _RESPONSE_FORMAT = {}
 
-<RECAP>
-* Keep the vulnerability name, description and remeidation as is, do not change the text
-* Convert the location into a GCP console URL
-</RECAP>
-"""
+# The query prompt is static, build its request object once and share it
+_QUERY_PART = types.Part.from_text(text=DISCOVERY_TOOL_QUERY_PROMPT)
 
 
-def gcp_project_tool(gcp_project_id: str):
+async def gcp_project_tool(gcp_project_id: str):
     """Analyze a GCP project referenced by a GCP project ID.
 
     Args:
@@ -155,164 +353,529 @@ def gcp_project_tool(gcp_project_id: str):
     try:
         LOGGER.info(f"Calling GCP project tool with project: {gcp_project_id}")
 
+        # The Google Search and Asset Inventory calls are independent network
+        # calls, run them concurrently
         LOGGER.info("Fetching latest SAIF recommendations using Google Search.")
         start_time = time.time()
-        saif_recommendations = google_search_tool(GOOGLE_SEARCH_SAIF_PROMPT)
-        LOGGER.info(f"Fetching SAIF recommendations took {time.time() - start_time:.2f} seconds.")
-
-        resources = _get_asset_inventory_resources(gcp_project_id)
-        LOGGER.info(f"Asset Inventory found {len(resources)} resources.")
-
-        if resources:
-            # Convert each protobuf resource object to a dictionary
-            resources_as_dicts = [
-                json.loads(MessageToJson(res._pb)) for res in resources
-            ]
-            # Dump the list of dictionaries into a single, formatted JSON string
-            asset_dump_text = json.dumps(resources_as_dicts, indent=2)
-        else:
-            asset_dump_text = "No resources were found in the project."
-
-        contents = [
-            types.Part.from_text(text=DISCOVERY_TOOL_QUERY_PROMPT),
-            types.Part.from_text(
-                text=f"GCP Asset Inventory export:\n{asset_dump_text}"
-            ),
-            types.Part.from_text(
-                text=f"LATEST SAIF RECOMMENDATIONS:\n{saif_recommendations}"
-            ),
-        ]
+        loop = asyncio.get_running_loop()
+        saif_future = loop.run_in_executor(
+            _IO_POOL, _timed, "Fetching SAIF recommendations", get_saif_recommendations
+        )
+        (
+            asset_dump_text,
+            resource_count,
+            missing_asset_types,
+            omitted_counts,
+        ) = await loop.run_in_executor(
+            _IO_POOL, _timed, "Fetching Asset Inventory export", _get_asset_dump, gcp_project_id
+        )
+        LOGGER.info(f"Asset Inventory found {resource_count} resources.")
+        missing_note = _missing_asset_types_note(missing_asset_types)
+        if not resource_count:
+            # A search still running is not waited for, it finishes in the
+            # background and fills the SAIF cache
+            if missing_asset_types:
+                return f"No GCP resources found in project {gcp_project_id}.\n\n{missing_note}"
+            return f"No GCP resources found in project {gcp_project_id}; nothing to audit."
+        saif_recommendations = await saif_future
+        LOGGER.info(f"Fetching SAIF recommendations and assets took {time.time() - start_time:.2f} seconds.")
 
         # write content to file for easier troubleshooting
-        with open("asset_dump.txt", "w") as f:
-            f.write(asset_dump_text)
-        with open("saif_recommendations.txt", "w") as f:
-            f.write(saif_recommendations)
+        if DEBUG_DUMP:
+            _DEBUG_DUMP_EXECUTOR.submit(_write_asset_debug_dump, asset_dump_text)
+            if saif_recommendations is not None:
+                _DEBUG_DUMP_EXECUTOR.submit(
+                    _write_debug_dump, "saif_recommendations.txt", saif_recommendations
+                )
 
         start_time = time.time()
-        client = genai.Client(
-            vertexai=True,
-            project=PROJECT_ID,
-            location=REGION,
-        )
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=contents,
-            config=types.GenerateContentConfig(
-                system_instruction=DISCOVERY_TOOL_SYSTEM_PROMPT,
-                temperature=0.1,
-            ),
-        )
+        client = get_genai_client()
+        config, uncached_parts = await _discovery_request(client, saif_recommendations)
+        if missing_asset_types:
+            uncached_parts = [types.Part.from_text(text=missing_note), *uncached_parts]
+
+        async def generate_report(asset_dump_chunk: str) -> str:
+            asset_dump_parts = await loop.run_in_executor(
+                _IO_POOL, _asset_dump_parts, asset_dump_chunk
+            )
+            return await _generate_report(
+                client,
+                config,
+                [_QUERY_PART, *asset_dump_parts, *uncached_parts],
+            )
+
+        # Oversized dumps are audited in parts by concurrent calls, keeping each
+        # prompt within bounds, and the partial reports are fused
+        asset_dump_chunks = _split_asset_dump(asset_dump_text)
+        if len(asset_dump_chunks) > 1:
+            LOGGER.info(f"Auditing the asset dump in {len(asset_dump_chunks)} parts.")
+        reports = await asyncio.gather(*map(generate_report, asset_dump_chunks))
         LOGGER.info(f"Generating security report took {time.time() - start_time:.2f} seconds.")
         LOGGER.info("Successfully received response from the model.")
-        if GENERATE_DASHBOARD:
+        note = SAIF_UNAVAILABLE_NOTE if saif_recommendations is None else ""
+        if missing_asset_types:
+            note = f"*{missing_note}*\n\n{note}"
+        if omitted_counts:
+            note = f"*{_omitted_resources_note(omitted_counts)}*\n\n{note}"
+        if not GENERATE_DASHBOARD:
+            return note + "\n\n".join(reports)
+
+        # A report that does not match the schema is returned as raw text rather
+        # than failing the whole scan
+        markdown_reports = []
+        vulnerabilities = []
+        # The dashboard table is replaced on publication, it is left as is rather
+        # than replaced with the findings of a partial export or an unparsed report
+        publish = not missing_asset_types
+        if missing_asset_types:
+            LOGGER.warning("Skipping the dashboard publication, the asset export is partial.")
+        for report in reports:
             try:
-                query = dedent(
-                    f"""
-                # Vulnerabilities
-                {response.text}
-                """
-                )
+                security_report = SecurityReport.model_validate_json(report)
+            except ValidationError as e:
+                LOGGER.warning(f"Could not parse the dashboard report, returning it as is: {e}")
+                markdown_reports.append(report)
+                if publish:
+                    LOGGER.warning("Skipping the dashboard publication, a report could not be parsed.")
+                publish = False
+                continue
+            markdown_reports.append(security_report.markdown_report)
+            vulnerabilities.extend(security_report.vulnerabilities)
+        if publish:
+            await loop.run_in_executor(_IO_POOL, _publish_dashboard, vulnerabilities)
+        return note + "\n\n".join(markdown_reports)
+    except Exception as e:
+        message = f"An exception occurred while calling GCP project tool: {e}"
+        LOGGER.exception(message)
+        return message
 
-                start_time = time.time()
-                contents = [
-                    types.Part.from_text(text=query),
-                ]
 
-                client = genai.Client(
-                    vertexai=True,
-                    project=PROJECT_ID,
-                    location=REGION,
-                )
-                response = client.models.generate_content(
-                    model=MODEL,
-                    contents=contents,
-                    config=types.GenerateContentConfig(
-                        system_instruction=DASHBOARD_SYSTEM_PROMPT,
-                        temperature=0.1,
-                        response_mime_type="application/json",
-                        response_schema=VulnerabilityList,
-                    ),
-                )
-                LOGGER.info(f"Generating dashboard data took {time.time() - start_time:.2f} seconds.")
-                vulnerabilities = json.loads(response.text)
-                table = pd.DataFrame(vulnerabilities["vulnerabilities"])
-                table["project_id"] = PROJECT_ID
-                table.to_gbq(
-                    f"{DASHBOARD_BQ_PROJECT}.{DASHBOARD_BQ_LOCATION}",
-                    project_id=DASHBOARD_BQ_PROJECT,
-                    if_exists="replace",
-                )
-                LOGGER.info(
-                    f"Successfully published to dashboard content to BigQuery: {DASHBOARD_BQ_PROJECT}.{DASHBOARD_BQ_LOCATION}"
-                )
-            except Exception as e:
-                LOGGER.warning(f"Error when publishing to dashboard: {e}")
+def _missing_asset_types_note(missing_asset_types: List[str]) -> str:
+    """Describes the asset types missing from a partial export, empty if complete."""
+    if not missing_asset_types:
+        return ""
+    return (
+        "Warning: the Asset Inventory export failed for these asset types, which are "
+        f"missing from the audit: {', '.join(missing_asset_types)}. Do not assume "
+        "they are absent or compliant."
+    )
+
+
+def _omitted_resources_note(omitted_counts: Dict[str, int]) -> str:
+    """Describes the resources left out of the audit by the per asset type cap."""
+    omitted = ", ".join(
+        f"{count} {asset_type}" for asset_type, count in omitted_counts.items()
+    )
+    return (
+        f"Warning: only the first {MAX_RESOURCES_PER_ASSET_TYPE} distinct resources of "
+        f"each asset type were audited in detail, these resources were left out: {omitted}."
+    )
+
+
+async def _generate_report(
+    client, config: types.GenerateContentConfig, contents: List[types.Part]
+) -> str:
+    """Streams a security report generation and returns the full response text."""
+    start_time = time.time()
+    stream = await client.aio.models.generate_content_stream(
+        model=MODEL,
+        contents=contents,
+        config=config,
+    )
+    # ADK function tools return a single result, so the streamed chunks are
+    # accumulated here rather than forwarded through the tool boundary
+    chunks = []
+    async for chunk in stream:
+        if chunk.text:
+            if not chunks:
+                LOGGER.info(f"First report chunk received after {time.time() - start_time:.2f} seconds.")
+            chunks.append(chunk.text)
+    return "".join(chunks)
+
+
+def _split_asset_dump(asset_dump_text: str) -> List[str]:
+    """
+    Splits an asset dump into JSON arrays of at most ASSET_DUMP_CHUNK_CHARS
+    characters, on resource boundaries.
 
-        return response.text
+    The dump holds one resource per line, in asset type group order, so each part
+    mostly covers related services. A single resource longer than the limit gets a
+    part of its own.
+    """
+    if len(asset_dump_text) <= ASSET_DUMP_CHUNK_CHARS:
+        return [asset_dump_text]
+    # Drop the opening and closing bracket lines and the trailing commas
+    lines = [line.rstrip(",") for line in asset_dump_text.split("\n")[1:-1]]
+    asset_dump_chunks = []
+    chunk_lines = []
+    # Brackets and separators are counted so that parts stay within the limit
+    chunk_size = 4
+    for line in lines:
+        if chunk_lines and chunk_size + len(line) > ASSET_DUMP_CHUNK_CHARS:
+            asset_dump_chunks.append("[\n" + ",\n".join(chunk_lines) + "\n]")
+            chunk_lines = []
+            chunk_size = 4
+        chunk_lines.append(line)
+        chunk_size += len(line) + 2
+    asset_dump_chunks.append("[\n" + ",\n".join(chunk_lines) + "\n]")
+    return asset_dump_chunks
+
+
+def _publish_dashboard(vulnerabilities: List[Vulnerability]):
+    """Replaces the dashboard BigQuery table with the vulnerabilities found."""
+    try:
+        rows = [
+            {**vulnerability.model_dump(), "project_id": PROJECT_ID}
+            for vulnerability in vulnerabilities
+        ]
+        get_bigquery_client().load_table_from_json(
+            rows,
+            f"{DASHBOARD_BQ_PROJECT}.{DASHBOARD_BQ_LOCATION}",
+            job_config=_DASHBOARD_LOAD_JOB_CONFIG,
+        ).result()
+        LOGGER.info(
+            f"Successfully published to dashboard content to BigQuery: {DASHBOARD_BQ_PROJECT}.{DASHBOARD_BQ_LOCATION}"
+        )
     except Exception as e:
-        message = f"An exception occurred while calling GCP project tool: {e}"
-        LOGGER.error(message)
-        LOGGER.error(f"Traceback: {traceback.format_exc()}")
-        return message
+        LOGGER.warning(f"Error when publishing to dashboard: {e}")
+
+
+def _timed(description: str, func, *args):
+    """Calls func with args and logs how long it took, including on failure."""
+    start_time = time.time()
+    try:
+        return func(*args)
+    finally:
+        LOGGER.info(f"{description} took {time.time() - start_time:.2f} seconds.")
+
+
+async def _discovery_request(
+    client, saif_recommendations: Optional[str]
+) -> Tuple[types.GenerateContentConfig, List[types.Part]]:
+    """
+    Returns the security report generation config and the prompt parts it does not
+    already hold.
+
+    The system prompt and SAIF recommendations are the same for every scan until
+    the SAIF cache expires, so they are stored as Gemini cached content and only
+    referenced by name, sparing their prefill on each call. Falls back to sending
+    them inline, always when the recommendations could not be fetched.
+    """
+    if saif_recommendations is None:
+        return _inline_discovery_request(saif_recommendations)
+    key = cache_key(MODEL, saif_recommendations)
+    cached_content = _PROMPT_CACHE.get(key)
+    if cached_content is None:
+        # Concurrent scans share a single cached content creation
+        cached_content = await _IN_FLIGHT.do(
+            key, _create_cached_content, client, key, saif_recommendations
+        )
+    if cached_content:
+        config = types.GenerateContentConfig(
+            cached_content=cached_content,
+            temperature=0.1,
+            **_RESPONSE_FORMAT,
+        )
+        return config, []
+    return _inline_discovery_request(saif_recommendations)
+
+
+async def _create_cached_content(client, key: str, saif_recommendations: str) -> str:
+    """Creates the cached content for the discovery request, empty name on failure."""
+    try:
+        cached_content = (
+            await client.aio.caches.create(
+                model=MODEL,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=_SYSTEM_PROMPT,
+                    contents=[saif_recommendations_part(saif_recommendations)],
+                    ttl=f"{PROMPT_CACHE_TTL_SECONDS}s",
+                ),
+            )
+        ).name
+        LOGGER.info(f"Created cached content {cached_content} for the system prompt.")
+    except Exception as e:
+        # e.g. the prompt is below the model's minimum cacheable size
+        LOGGER.warning(f"Could not create cached content, sending the system prompt inline: {e}")
+        cached_content = ""
+    _PROMPT_CACHE.set(key, cached_content)
+    return cached_content
+
+
+def _inline_discovery_request(
+    saif_recommendations: Optional[str],
+) -> Tuple[types.GenerateContentConfig, List[types.Part]]:
+    """Returns the generation config and SAIF part for a request without cached content."""
+    config = types.GenerateContentConfig(
+        system_instruction=_SYSTEM_PROMPT,
+        temperature=0.1,
+        **_RESPONSE_FORMAT,
+    )
+    return config, [saif_recommendations_part(saif_recommendations)]
+
+
+def _asset_dump_parts(asset_dump_text: str) -> List[types.Part]:
+    """
+    Returns the prompt parts for the asset dump.
+
+    When ASSET_DUMP_BUCKET is set, the dump is uploaded once per content hash and
+    referenced by URI so the request body stays small. Falls back to inline text.
+    """
+    if ASSET_DUMP_BUCKET:
+        try:
+            return [
+                types.Part.from_text(text="GCP Asset Inventory export:"),
+                types.Part.from_uri(
+                    file_uri=_upload_asset_dump(asset_dump_text),
+                    mime_type="text/plain",
+                ),
+            ]
+        except Exception as e:
+            LOGGER.warning(f"Could not upload the asset dump, sending it inline: {e}")
+    return [types.Part.from_text(text=f"GCP Asset Inventory export:\n{asset_dump_text}")]
+
+
+def _upload_asset_dump(asset_dump_text: str) -> str:
+    """Uploads the asset dump to ASSET_DUMP_BUCKET unless present and returns its URI."""
+    data = asset_dump_text.encode("utf-8")
+    blob_name = f"asset-dumps/{hashlib.sha256(data).hexdigest()}.json"
+    blob = get_storage_client().bucket(ASSET_DUMP_BUCKET).blob(blob_name)
+    if not blob.exists():
+        blob.upload_from_string(data, content_type="text/plain")
+        LOGGER.info(f"Uploaded the asset dump to gs://{ASSET_DUMP_BUCKET}/{blob_name}.")
+    return f"gs://{ASSET_DUMP_BUCKET}/{blob_name}"
+
+
+def _write_debug_dump(filename: str, text: str):
+    """Writes a prompt input to the working directory, logging rather than raising."""
+    try:
+        Path(filename).write_text(text, encoding="utf-8")
+    except OSError as e:
+        LOGGER.warning(f"Could not write debug dump {filename}: {e}")
+
+
+def _write_asset_debug_dump(asset_dump_text: str):
+    """
+    Writes the asset dump pretty-printed for reading, the prompt keeps the compact
+    JSON.
+    """
+    try:
+        asset_dump_text = orjson.dumps(
+            orjson.loads(asset_dump_text), option=orjson.OPT_INDENT_2
+        ).decode()
+    except orjson.JSONDecodeError:
+        pass
+    _write_debug_dump("asset_dump.txt", asset_dump_text)
+
+
+def _get_asset_dump(project_id: str) -> Tuple[str, int, List[str], Dict[str, int]]:
+    """
+    Returns the project's asset JSON dump, resource count, the asset types that
+    could not be exported and the number of resources left out of the dump per
+    asset type. Complete exports are cached on disk for ASSET_CACHE_TTL_SECONDS so
+    repeated audits skip the Asset Inventory export.
+    """
+    key = f"{project_id}:full" if FULL_ASSET_SCAN else project_id
+    cached_dump = _ASSET_CACHE.get(key)
+    # Entries written before omitted counts were cached hold two items
+    if cached_dump is not None and len(cached_dump) == 3:
+        LOGGER.info(f"Using cached Asset Inventory export for project {project_id}.")
+        asset_dump_text, count, omitted_counts = cached_dump
+        return asset_dump_text, count, [], omitted_counts
+    asset_dump_text, count, missing_asset_types, omitted_counts = _export_asset_inventory(
+        project_id
+    )
+    # Partial exports are not cached so the next audit retries the failed groups
+    if count and not missing_asset_types:
+        _ASSET_CACHE.set(key, [asset_dump_text, count, omitted_counts])
+    return asset_dump_text, count, missing_asset_types, omitted_counts
+
+
+def _export_asset_inventory(
+    project_id: str,
+) -> Tuple[str, int, List[str], Dict[str, int]]:
+    """
+    Serializes a project's resources into a JSON array, one resource per line.
+
+    Resources that only differ by name, e.g. the revisions of a Cloud Run service,
+    are written once with the names of the others in "_duplicate_names", so
+    findings can still point at each of them. Only the first
+    MAX_RESOURCES_PER_ASSET_TYPE distinct resources of each asset type are kept,
+    the others are counted and named, with their duplicates, in a trailing summary
+    entry per asset type to keep the prompt bounded on large projects. Returns the JSON text, the number of
+    resources found and the asset types that could not be exported.
+    """
+    search_results, missing_asset_types = _get_asset_inventory_resources(project_id)
+    resources = []
+    representatives = {}
+    count = 0
+    type_counts = Counter()
+    omitted_resources = defaultdict(list)
+    for res in search_results:
+        count += 1
+        resource = _resource_to_dict(res)
+        shape = None
+        if res.asset_type not in _NO_DEDUP_ASSET_TYPES:
+            shape = _resource_shape(resource)
+            representative = representatives.get(shape)
+            if representative is not None:
+                representative.setdefault("_duplicate_names", []).append(res.name)
+                continue
+        # Representatives are registered even past the cap, so that duplicates of
+        # an omitted resource are not counted as distinct resources
+        if shape is not None:
+            representatives[shape] = resource
+        type_counts[res.asset_type] += 1
+        if type_counts[res.asset_type] <= MAX_RESOURCES_PER_ASSET_TYPE:
+            resources.append(resource)
+        else:
+            omitted_resources[res.asset_type].append(resource)
+
+    # Resources are written as compact JSON on purpose: indentation costs CPU here
+    # and prompt tokens later without helping the model read the dump
+    buffer = io.BytesIO()
+    omitted_counts = {}
+    for resource in resources:
+        buffer.write(b",\n" if buffer.tell() else b"[\n")
+        buffer.write(orjson.dumps(resource))
+    for asset_type, omitted in omitted_resources.items():
+        omitted_names = [
+            name
+            for resource in omitted
+            for name in (resource.get("name", ""), *resource.get("_duplicate_names", ()))
+        ]
+        omitted_counts[asset_type] = len(omitted_names)
+        LOGGER.info(
+            f"Omitting {len(omitted)} distinct {asset_type} resources "
+            f"({len(omitted_names)} in total) from the asset dump."
+        )
+        buffer.write(b",\n")
+        buffer.write(
+            orjson.dumps(
+                {
+                    "_summary": {
+                        "asset_type": asset_type,
+                        "omitted": len(omitted),
+                        "omitted_names": omitted_names,
+                    }
+                }
+            )
+        )
+    if count:
+        buffer.write(b"\n]")
+    return buffer.getvalue().decode(), count, missing_asset_types, omitted_counts
+
+
+def _resource_shape(resource: dict) -> bytes:
+    """Digests a resource dict without its identifying and volatile fields."""
+    shape = {
+        field: value
+        for field, value in resource.items()
+        if field not in _RESOURCE_IDENTITY_FIELDS
+    }
+    return hashlib.blake2b(
+        orjson.dumps(shape, option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).digest()
 
 
 def _get_asset_inventory_resources(
     project_id: str,
-) -> List[asset_v1.types.ResourceSearchResult]:
+) -> Tuple[List[asset_v1.types.ResourceSearchResult], List[str]]:
     """
-    Fetches all resources from GCP Asset Inventory for a given project.
+    Returns all resources from GCP Asset Inventory for a given project, and the
+    asset types of the groups that could not be searched.
+
+    Each group of _ASSET_TYPE_GROUPS is searched concurrently with its own pager,
+    and results are kept in group order so the dump is deterministic. A group that
+    fails is logged and reported as missing, and an error is raised when every
+    group fails.
     """
     start_time = time.time()
-    try:
-        client = asset_v1.AssetServiceClient()
-        parent_scope = f"projects/{project_id}"
-        read_mask = field_mask_pb2.FieldMask(paths=["*"])
-
-        asset_inventory_response = client.search_all_resources(
-            request={
-                "asset_types": [
-                    "iam.googleapis.com/ServiceAccountKey",
-                    "iam.googleapis.com/ServiceAccount",
-                    "compute.googleapis.com/Route",
-                    "storage.googleapis.com/Bucket",
-                    "dns.googleapis.com/ResourceRecordSet",
-                    "dataplex.googleapis.com/EntryGroup",
-                    "compute.googleapis.com/ForwardingRule",
-                    "compute.googleapis.com/Address",
-                    "logging.googleapis.com/LogSink",
-                    "logging.googleapis.com/LogBucket",
-                    "compute.googleapis.com/UrlMap",
-                    "compute.googleapis.com/Subnetwork",
-                    "sqladmin.googleapis.com/Instance",
-                    "servicedirectory.googleapis.com/Service",
-                    "servicedirectory.googleapis.com/Namespace",
-                    "servicedirectory.googleapis.com/Endpoint",
-                    "run.googleapis.com/Service",
-                    "run.googleapis.com/Revision",
-                    "run.googleapis.com/Job",
-                    "dns.googleapis.com/ResponsePolicy",
-                    "dns.googleapis.com/ManagedZone",
-                    "compute.googleapis.com/TargetHttpsProxy",
-                    "compute.googleapis.com/TargetHttpProxy",
-                    "compute.googleapis.com/SslCertificate",
-                    "compute.googleapis.com/SecurityPolicy",
-                    "compute.googleapis.com/Project",
-                    "compute.googleapis.com/NetworkEndpointGroup",
-                    "compute.googleapis.com/Network",
-                    "compute.googleapis.com/BackendService",
-                    "cloudresourcemanager.googleapis.com/Project",
-                    "cloudbilling.googleapis.com/ProjectBillingInfo",
-                    "bigquery.googleapis.com/Table",
-                    "bigquery.googleapis.com/Dataset",
-                ],
-                "scope": parent_scope,
-                "read_mask": read_mask,
+    resources = []
+    missing_asset_types = []
+    error = None
+    futures = [
+        _ASSET_SEARCH_POOL.submit(_search_resources, project_id, asset_types)
+        for asset_types in _ASSET_TYPE_GROUPS
+    ]
+    for asset_types, future in zip(_ASSET_TYPE_GROUPS, futures):
+        try:
+            resources.extend(future.result())
+        except Exception as e:
+            LOGGER.exception(
+                f"An unexpected error occurred while fetching {', '.join(asset_types)} assets: {e}"
+            )
+            missing_asset_types.extend(asset_types)
+            error = e
+    LOGGER.info(f"Fetching Asset Inventory resources took {time.time() - start_time:.2f} seconds.")
+    if len(missing_asset_types) == sum(len(asset_types) for asset_types in _ASSET_TYPE_GROUPS):
+        raise RuntimeError(f"Asset Inventory search failed for every asset type: {error}") from error
+    return resources, missing_asset_types
+
+
+def _search_resources(
+    project_id: str, asset_types: List[str]
+) -> List[asset_v1.types.ResourceSearchResult]:
+    """
+    Returns a project's resources of the given asset types, fetching every page.
+    """
+    client = get_asset_client()
+    if FULL_ASSET_SCAN:
+        paths = ["*"]
+    elif any(asset_type in _VERSIONED_RESOURCE_FIELDS for asset_type in asset_types):
+        paths = [*_ASSET_READ_MASK_PATHS, "versionedResources"]
+    else:
+        paths = _ASSET_READ_MASK_PATHS
+    read_mask = field_mask_pb2.FieldMask(paths=paths)
+    asset_inventory_response = client.search_all_resources(
+        request={
+            "asset_types": asset_types,
+            "scope": f"projects/{project_id}",
+            "read_mask": read_mask,
+        },
+        retry=_ASSET_SEARCH_RETRY,
+    )
+    return list(asset_inventory_response)
+
+
+def _resource_to_dict(res: asset_v1.types.ResourceSearchResult) -> dict:
+    """
+    Converts an Asset Inventory search result to a plain dict, skipping empty fields.
+
+    Only the fields in _ASSET_READ_MASK_PATHS are populated by the search, so only
+    those are read, directly rather than by walking the descriptor with
+    MessageToDict. The opaque additional_attributes payload goes through
+    MessageToDict, as do the versioned_resources, reduced to the configuration
+    fields of _VERSIONED_RESOURCE_FIELDS, and the whole result with
+    FULL_ASSET_SCAN.
+    """
+    pb = res._pb
+    if FULL_ASSET_SCAN:
+        return MessageToDict(pb, preserving_proto_field_name=True)
+    resource = {}
+    for field in _RESOURCE_SCALAR_FIELDS:
+        value = getattr(pb, field)
+        if value:
+            resource[field] = value
+    for field in _RESOURCE_REPEATED_FIELDS:
+        values = getattr(pb, field)
+        if values:
+            resource[field] = list(values)
+    if pb.labels:
+        resource["labels"] = dict(pb.labels)
+    if pb.HasField("additional_attributes"):
+        resource["additional_attributes"] = MessageToDict(pb.additional_attributes)
+    config_fields = _VERSIONED_RESOURCE_FIELDS.get(pb.asset_type)
+    if config_fields and pb.versioned_resources:
+        resource["versioned_resources"] = [
+            {
+                "version": versioned_resource.version,
+                "resource": {
+                    field: MessageToDict(versioned_resource.resource.fields[field])
+                    for field in config_fields
+                    if field in versioned_resource.resource.fields
+                },
             }
-        )
-        all_resources = list(asset_inventory_response)
-        LOGGER.info(f"Fetching Asset Inventory resources took {time.time() - start_time:.2f} seconds.")
-        return all_resources
-    except Exception as e:
-        LOGGER.error(f"An unexpected error occurred while fetching assets: {e}")
-        return []
+            for versioned_resource in pb.versioned_resources
+        ]
+    return resource
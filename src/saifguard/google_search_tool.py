@@ -1,51 +1,110 @@
+import asyncio
+import functools
 import logging
-import traceback
+from typing import Optional
 
-from google import genai
 from google.genai import types
-from saifguard.config import MODEL, PROJECT_ID, REGION
+from saifguard.cache import DiskCache, TTLCache, cache_key
+from saifguard.clients import get_genai_client
+from saifguard.config import (
+    GOOGLE_SEARCH_SAIF_PROMPT,
+    MODEL,
+    SAIF_CACHE_TTL_SECONDS,
+)
 
 LOGGER = logging.getLogger(__name__)
 
+_SAIF_CACHE = TTLCache(ttl=SAIF_CACHE_TTL_SECONDS, maxsize=1)
+_SAIF_DISK_CACHE = DiskCache("saif", ttl=SAIF_CACHE_TTL_SECONDS)
 
-# Configure the client
-def google_search_tool(query: str):
+# Google Search grounding settings are the same for every query
+_GROUNDED_SEARCH_CONFIG = types.GenerateContentConfig(
+    tools=[types.Tool(google_search=types.GoogleSearch())],
+    temperature=0.1,
+)
+
+# Prepended to reports generated without the latest SAIF recommendations
+SAIF_UNAVAILABLE_NOTE = (
+    "*Note: the latest SAIF recommendations could not be fetched, this report "
+    "relies on the model's own knowledge of SAIF.*\n\n"
+)
+
+
+async def google_search_tool(query: str):
     """Use Google Search to answer a question.
 
     Args:
         query (str): The user's query that will be searched on Google.
     """
     try:
-        LOGGER.info(f"Calling Google Search tool with query: {query}")
+        # The grounded search is a blocking call, kept off the event loop
+        return await asyncio.to_thread(_google_search, query)
+    except Exception as e:
+        message = f"An exception occurred while calling Google Search tool: {e}"
+        LOGGER.exception(message)
+        return message
 
-        # Configure the client to use Vertex AI
-        client = genai.Client(
-            vertexai=True,
-            project=PROJECT_ID,
-            location=REGION,
-        )
 
-        # Define the grounding tool
-        grounding_tool = types.Tool(google_search=types.GoogleSearch())
+def get_saif_recommendations() -> Optional[str]:
+    """Fetch the latest SAIF recommendations, cached for SAIF_CACHE_TTL_SECONDS.
+
+    The SAIF prompt is constant, so the grounded search result is shared by every
+    tool call until it expires, in memory and on disk across restarts. Entries are
+    keyed by model and prompt, so changing either one starts a fresh search.
+    Returns None when the search fails; failures are not cached.
+    """
+    key = cache_key(MODEL, GOOGLE_SEARCH_SAIF_PROMPT)
+    saif_recommendations = _SAIF_CACHE.get(key)
+    if saif_recommendations is not None:
+        LOGGER.info("Using cached SAIF recommendations.")
+        return saif_recommendations
+    saif_recommendations = _SAIF_DISK_CACHE.get(key)
+    if saif_recommendations is not None:
+        LOGGER.info("Using SAIF recommendations cached on disk.")
+        _SAIF_CACHE.set(key, saif_recommendations)
+        return saif_recommendations
+    try:
+        saif_recommendations = _google_search(GOOGLE_SEARCH_SAIF_PROMPT)
+    except Exception as e:
+        LOGGER.exception(f"An exception occurred while fetching SAIF recommendations: {e}")
+        return None
+    _SAIF_CACHE.set(key, saif_recommendations)
+    _SAIF_DISK_CACHE.set(key, saif_recommendations)
+    return saif_recommendations
 
-        # Configure generation settings
-        config = types.GenerateContentConfig(
-            tools=[grounding_tool], 
-            temperature=0.1,
-        )
 
-        # Make the request
-        response = client.models.generate_content(
-            model=MODEL,
-            contents=query,
-            config=config,
+@functools.lru_cache(maxsize=8)
+def saif_recommendations_part(saif_recommendations: Optional[str]) -> types.Part:
+    """Build the prompt part carrying the SAIF recommendations.
+
+    The recommendations only change when the cache expires, so the part is built
+    once per distinct text and shared by every prompt. Callers must not mutate it.
+    When they could not be fetched (None), the part says so instead.
+    """
+    if saif_recommendations is None:
+        return types.Part.from_text(
+            text="LATEST SAIF RECOMMENDATIONS: unavailable, the search failed. "
+            "Rely on your own knowledge of the SAIF framework."
         )
+    return types.Part.from_text(text=f"LATEST SAIF RECOMMENDATIONS:\n{saif_recommendations}")
 
-        LOGGER.info("Successfully received response from the model with Google Search grounding.")
-        LOGGER.info(f"Google Search response: {response}")
-        return response.text
-    except Exception as e:
-        message = f"An exception occurred while calling Google Search tool: {e}"
-        LOGGER.error(message)
-        LOGGER.error(f"Traceback: {traceback.format_exc()}")
-        return message
+
+def _google_search(query: str) -> str:
+    """
+    Runs a Google Search grounded generation and returns the response text.
+    """
+    LOGGER.info(f"Calling Google Search tool with query: {query}")
+
+    # Shared Vertex AI client, its HTTP/2 connection pool is reused across searches
+    client = get_genai_client()
+
+    # Make the request
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=query,
+        config=_GROUNDED_SEARCH_CONFIG,
+    )
+
+    LOGGER.info("Successfully received response from the model with Google Search grounding.")
+    LOGGER.debug("Google Search response: %r", response)
+    return response.text
@@ -0,0 +1,74 @@
+import asyncio
+from typing import AsyncIterator
+
+_DONE = object()
+
+
+async def batched(
+    chunks: AsyncIterator[str],
+    min_batch: int = 1,
+    growth: int = 3,
+    max_batch: int = 50,
+    max_wait_ms: float = 20,
+) -> AsyncIterator[str]:
+    """Coalesce streamed text chunks into progressively larger writes.
+
+    The first batch flushes after `min_batch` chunks so the time to first byte is
+    unchanged, then the batch size grows by `growth` up to `max_batch`. A partial
+    batch is flushed once its oldest chunk has waited `max_wait_ms`, so a slow
+    producer never holds text back for long.
+
+    `chunks` is driven by a single producer task feeding a queue, so context
+    variables set inside it (e.g. OpenTelemetry spans) stay in one context for
+    its whole lifetime.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_batch)
+    producer = asyncio.create_task(_produce(chunks, queue))
+    max_wait = max_wait_ms / 1000
+    batch_size = min_batch
+    buffer = []
+    deadline = None
+    try:
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    chunk = await queue.get()
+            except TimeoutError:
+                pass
+            else:
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    # Text received before the error is still delivered
+                    if buffer:
+                        yield "".join(buffer)
+                    raise chunk
+                buffer.append(chunk)
+                if deadline is None:
+                    deadline = loop.time() + max_wait
+                if len(buffer) < batch_size:
+                    continue
+            yield "".join(buffer)
+            buffer.clear()
+            deadline = None
+            batch_size = min(batch_size * growth, max_batch)
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        producer.cancel()
+        await asyncio.wait({producer})
+
+
+async def _produce(chunks: AsyncIterator[str], queue: asyncio.Queue) -> None:
+    """Iterates and closes `chunks` from this task, ending with _DONE or the error."""
+    try:
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        finally:
+            await chunks.aclose()
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(_DONE)